@@ -5,7 +5,10 @@ and then later create a ILAMBAnalysis ABC which uses it in an ILAMB analysis.
 
 """
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import partial
 from typing import Union
 
 import numpy as np
@@ -16,6 +19,186 @@ from ilamb3 import compare as cmp
 from ilamb3.analysis.base import ILAMBAnalysis
 from ilamb3.regions import Regions
 
+try:
+    from fast_histogram import histogram2d as fh2d
+except ImportError:  # pragma: no cover
+    fh2d = None
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+
+if numba is not None:
+    # some numba threading layers fail if parallel functions are launched concurrently
+    # from several python threads, so launches are serialized
+    _NUMBA_LOCK = threading.Lock()
+
+    @numba.njit(cache=True)
+    def _kernel_index(x, lo, scale, nbin):
+        """Return the uniform bin in which `x` falls, clipped to the bins."""
+        return min(max(int((x - lo) * scale), 0), nbin - 1)
+
+    @numba.njit(parallel=True, cache=True)
+    def _fused_histogram_moments(ind, dep, ilo, ihi, dlo, dhi, nbin, nthread):
+        """Return the 2D histogram and the per-bin count, mean, and standard deviation
+        of `dep`.
+
+        Each of the `nthread` threads accumulates into its own slice of the buffers
+        which are reduced once all the data has been binned. The histogram, counts, and
+        sums are accumulated in a first pass over the data and the squared deviations
+        from the means in a second, as in the numpy implementation.
+
+        """
+        dist = np.zeros((nthread, nbin, nbin))
+        sums = np.zeros((nthread, 3, nbin))
+        iscale = nbin / (ihi - ilo)
+        dscale = nbin / (dhi - dlo)
+        chunk = (ind.size + nthread - 1) // nthread
+        for t in numba.prange(nthread):
+            for k in range(t * chunk, min((t + 1) * chunk, ind.size)):
+                x = ind[k]
+                y = dep[k]
+                i = _kernel_index(x, ilo, iscale, nbin)
+                sums[t, 0, i] += 1
+                sums[t, 1, i] += y
+                if ilo <= x <= ihi and dlo <= y <= dhi:
+                    j = _kernel_index(y, dlo, dscale, nbin)
+                    dist[t, i, j] += 1
+        cnt = np.zeros(nbin)
+        mean = np.zeros(nbin)
+        for t in range(nthread):
+            cnt += sums[t, 0]
+            mean += sums[t, 1]
+        for i in range(nbin):
+            if cnt[i] > 0:
+                mean[i] /= cnt[i]
+        for t in numba.prange(nthread):
+            for k in range(t * chunk, min((t + 1) * chunk, ind.size)):
+                i = _kernel_index(ind[k], ilo, iscale, nbin)
+                sums[t, 2, i] += (dep[k] - mean[i]) ** 2
+        std = np.zeros(nbin)
+        for t in range(nthread):
+            std += sums[t, 2]
+        for i in range(nbin):
+            if cnt[i] > 0:
+                std[i] = np.sqrt(std[i] / cnt[i])
+        return dist.sum(axis=0), cnt, mean, std
+
+
+def _bin_index(var: np.ndarray, lim: np.ndarray, nbin: int) -> np.ndarray:
+    """Return the index of the uniform bin of `lim` in which each value of `var` falls,
+    values outside the limits being placed in the first or last bin."""
+    # the limit is subtracted as an array so that it is not cast to the precision of
+    # single precision data, matching the double precision arithmetic of the kernel
+    which_bin = (var - lim[:1]) * (nbin / (lim[1] - lim[0]))
+    return which_bin.astype(np.intp).clip(0, nbin - 1)
+
+
+def _bin_limits(limits: list[float], log: bool) -> np.ndarray:
+    """Return the limits of the uniform bins, in log space for log-scaled variables.
+
+    As in `np.histogram`, a zero-width range is widened by 0.5 on either side so that
+    constant data may still be binned.
+
+    """
+    lim = np.asarray(limits, dtype=float)
+    lim = np.log10(lim) if log else lim
+    if lim[0] == lim[1]:
+        lim = lim + [-0.5, 0.5]
+    return lim
+
+
+def _histogram_moments(
+    ind: np.ndarray,
+    dep: np.ndarray,
+    ind_lim: np.ndarray,
+    dep_lim: np.ndarray,
+    nbin: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return the 2D histogram and the per-bin count, mean, and standard deviation of
+    `dep` in `nbin` uniform bins of `ind`.
+
+    Bins with no data are given a mean and standard deviation of 0.
+
+    """
+    if numba is not None:
+        with _NUMBA_LOCK:
+            return _fused_histogram_moments(
+                ind,
+                dep,
+                ind_lim[0],
+                ind_lim[1],
+                dep_lim[0],
+                dep_lim[1],
+                nbin,
+                numba.get_num_threads(),
+            )
+
+    # The bins are uniform so the bin index is computed directly rather than searched
+    # for. The limits are compared as arrays so that they are not cast to the precision
+    # of the data.
+    which_bin = _bin_index(ind, ind_lim, nbin)
+    ilo, ihi = ind_lim[:1], ind_lim[1:]
+    dlo, dhi = dep_lim[:1], dep_lim[1:]
+    if fh2d is None:
+        # count the points within the limits from their bin indices, the upper edges
+        # being closed as in the kernel
+        inside = (ind >= ilo) & (ind <= ihi) & (dep >= dlo) & (dep <= dhi)
+        dist = np.bincount(
+            which_bin[inside] * nbin + _bin_index(dep[inside], dep_lim, nbin),
+            minlength=nbin * nbin,
+        )
+        dist = dist.reshape(nbin, nbin).astype(float)
+    else:
+        dist = fh2d(ind, dep, bins=nbin, range=[ind_lim, dep_lim])
+        # fast-histogram excludes the upper edges, so the points which lie on them are
+        # added to the last bins
+        edge = (ind == ihi) | (dep == dhi)
+        edge &= (ind >= ilo) & (ind <= ihi) & (dep >= dlo) & (dep <= dhi)
+        if edge.any():
+            np.add.at(
+                dist,
+                (which_bin[edge], _bin_index(dep[edge], dep_lim, nbin)),
+                1,
+            )
+
+    # accumulate the per-bin moments with a pass over the data for the mean and another
+    # for the variance
+    cnt = np.bincount(which_bin, minlength=nbin).astype(float)
+    empty = cnt == 0
+    with np.errstate(under="ignore", invalid="ignore", divide="ignore"):
+        mean = np.bincount(which_bin, weights=dep, minlength=nbin) / cnt
+        mean[empty] = 0
+        std = np.sqrt(
+            np.bincount(which_bin, weights=(dep - mean[which_bin]) ** 2, minlength=nbin)
+            / cnt
+        )
+        std[empty] = 0
+    return dist, cnt, mean, std
+
+
+def _check_aligned(*args: xr.DataArray) -> None:
+    """Raise a ValueError unless the dataarrays share the same sizes and indices along
+    their common dimensions.
+
+    This is the check that `xr.align(*args, join="exact")` performs, without building
+    the aligned copies which we do not need.
+
+    """
+    first, *others = args
+    for other in others:
+        for dim in set(first.dims) & set(other.dims):
+            if first.sizes[dim] != other.sizes[dim] or (
+                dim in first.indexes
+                and dim in other.indexes
+                and not first.indexes[dim].equals(other.indexes[dim])
+            ):
+                raise ValueError(
+                    f"cannot align objects with join='exact' along dimension '{dim}'"
+                )
+
 
 @dataclass
 class Relationship:
@@ -29,6 +212,10 @@ class Relationship:
     dep_label: str = ""
     ind_label: str = ""
     order: int = 1
+    _dep_flat: np.ndarray = field(init=False, default_factory=lambda: None)
+    _ind_flat: np.ndarray = field(init=False, default_factory=lambda: None)
+    _dep_range: list[float] = field(init=False, default_factory=lambda: None)
+    _ind_range: list[float] = field(init=False, default_factory=lambda: None)
     _dep_limits: list[float] = field(init=False, default_factory=lambda: None)
     _ind_limits: list[float] = field(init=False, default_factory=lambda: None)
     _dist2d: np.ndarray = field(init=False, default_factory=lambda: None)
@@ -43,24 +230,44 @@ class Relationship:
         assert isinstance(self.ind, xr.DataArray)
         self.dep = self.dep.sortby(list(self.dep.sizes.keys()))
         self.ind = self.ind.sortby(list(self.ind.sizes.keys()))
-        self.dep, self.ind = xr.align(self.dep, self.ind, join="exact")
+        _check_aligned(self.dep, self.ind)
         if self.color is not None:
             assert isinstance(self.color, xr.DataArray)
             self.color = self.color.sortby(list(self.color.sizes.keys()))
-            self.dep, self.ind, self.color = xr.align(
-                self.dep, self.ind, self.color, join="exact"
-            )
+            _check_aligned(self.dep, self.ind, self.color)
+
+        # only consider where both are valid and finite, the analysis only needs these
+        # values and so we store them flattened. Single precision is plenty for
+        # binning linear data and halves the memory traffic in building the responses.
+        # The variables need only be broadcastable, so the pair is broadcast first.
+        dep, ind = xr.broadcast(self.dep, self.ind)
+        ind = ind.transpose(*dep.dims).values.ravel()
+        dep = dep.values.ravel()
+        keep = np.isfinite(dep)
+        keep &= np.isfinite(ind)
+        self._dep_flat = dep[keep].astype(np.float32, copy=False)
+        self._ind_flat = ind[keep].astype(np.float32, copy=False)
+
+        # the ranges are needed to check log-scaled data and to compute limits, which
+        # are computed in double precision so that the padding is not rounded away
+        def _range(var):
+            return [float(var.min()), float(var.max())] if var.size else [np.nan] * 2
+
+        self._dep_range = _range(self._dep_flat)
+        self._ind_range = _range(self._ind_flat)
+        if self.dep_log:
+            assert self._dep_range[0] > 0
+        if self.ind_log:
+            assert self._ind_range[0] > 0
 
-        # only consider where both are valid and finite
-        keep = self.dep.notnull() * self.ind.notnull()
-        keep *= np.isfinite(self.dep)
-        keep *= np.isfinite(self.ind)
-        self.dep = xr.where(keep, self.dep, np.nan)
-        self.ind = xr.where(keep, self.ind, np.nan)
+        # the bins are uniform in log space for log-scaled variables, so we store them
+        # already transformed rather than taking the log each time a response is built.
+        # The logs are kept in double precision, as are those of the limits, so that
+        # rounding does not move the extreme values outside the limits.
         if self.dep_log:
-            assert self.dep.min() > 0
+            self._dep_flat = np.log10(self._dep_flat, dtype=float)
         if self.ind_log:
-            assert self.ind.min() > 0
+            self._ind_flat = np.log10(self._ind_flat, dtype=float)
 
     def compute_limits(
         self, rel: Union["Relationship", None] = None
@@ -75,8 +282,8 @@ class Relationship:
 
         """
 
-        def _singlelimit(var, limit=None):
-            lim = [var.min(), var.max()]
+        def _singlelimit(var_range, limit=None):
+            lim = list(var_range)
             delta = 1e-8 * (lim[1] - lim[0])
             lim[0] -= delta
             lim[1] += delta
@@ -87,11 +294,11 @@ class Relationship:
                 limit[1] = max(limit[1], lim[1])
             return limit
 
-        dep_lim = _singlelimit(self.dep)
-        ind_lim = _singlelimit(self.ind)
+        dep_lim = _singlelimit(self._dep_range)
+        ind_lim = _singlelimit(self._ind_range)
         if rel is not None:
-            dep_lim = _singlelimit(self.dep, limit=dep_lim)
-            ind_lim = _singlelimit(self.ind, limit=ind_lim)
+            dep_lim = _singlelimit(rel._dep_range, limit=dep_lim)
+            ind_lim = _singlelimit(rel._ind_range, limit=ind_lim)
             rel._dep_limits = dep_lim
             rel._ind_limits = ind_lim
         self._dep_limits = dep_lim
@@ -111,53 +318,32 @@ class Relationship:
         """
         # if no limits have been created, make them now
         if self._dep_limits is None or self._ind_limits is None:
-            self._dep_limits, self._ind_limits = self.compute_limits(
-                dep_lim=self._dep_limits,
-                ind_lim=self._ind_limits,
-            )
+            self.compute_limits()
 
-        # compute the 2d distribution
-        ind = np.ma.masked_invalid(self.ind.values).compressed()
-        dep = np.ma.masked_invalid(self.dep.values).compressed()
-        xedges = nbin
-        yedges = nbin
+        # compute the 2d distribution, the bins are uniform in log space for any
+        # variable that is log-scaled
+        ind_lim = _bin_limits(self._ind_limits, self.ind_log)
+        dep_lim = _bin_limits(self._dep_limits, self.dep_log)
+        dist, cnt, mean, std = _histogram_moments(
+            self._ind_flat, self._dep_flat, ind_lim, dep_lim, nbin
+        )
+        xedges = np.linspace(ind_lim[0], ind_lim[1], nbin + 1)
+        yedges = np.linspace(dep_lim[0], dep_lim[1], nbin + 1)
         if self.ind_log:
-            xedges = 10 ** np.linspace(
-                np.log10(self.ind_limits[0]), np.log10(self.ind_limits[1]), nbin + 1
-            )
+            xedges = 10**xedges
         if self.dep_log:
-            yedges = 10 ** np.linspace(
-                np.log10(self.dep_limits[0]), np.log10(self.dep_limits[1]), nbin + 1
-            )
-        dist, xedges, yedges = np.histogram2d(
-            ind, dep, bins=[xedges, yedges], range=[self._ind_limits, self._dep_limits]
-        )
+            yedges = 10**yedges
         dist = np.ma.masked_values(dist.T, 0).astype(float)
         dist /= dist.sum()
         self._dist2d = dist
         self._ind_edges = xedges
         self._dep_edges = yedges
 
-        # compute a binned functional response
-        which_bin = np.digitize(ind, xedges).clip(1, xedges.size - 1) - 1
-        mean = np.ma.zeros(xedges.size - 1)
-        std = np.ma.zeros(xedges.size - 1)
-        cnt = np.ma.zeros(xedges.size - 1)
+        # compute a binned functional response, empty bins will get masked out
         with np.errstate(under="ignore"):
-            for i in range(mean.size):
-                depi = dep[which_bin == i]
-                cnt[i] = depi.size
-                if cnt[i] == 0:  # will get masked out later
-                    mean[i] = 0
-                    std[i] = 0
-                else:
-                    if self.dep_log:
-                        depi = np.log10(depi)
-                        mean[i] = 10 ** depi.mean()
-                        std[i] = 10 ** depi.std()
-                    else:
-                        mean[i] = depi.mean()
-                        std[i] = depi.std()
+            if self.dep_log:
+                mean = np.where(cnt == 0, 0, 10**mean)
+                std = np.where(cnt == 0, 0, 10**std)
             mean = np.ma.masked_array(mean, mask=(cnt / cnt.sum()) < eps)
             std = np.ma.masked_array(std, mask=(cnt / cnt.sum()) < eps)
         self._response_mean = mean
@@ -165,13 +351,34 @@ class Relationship:
 
     def score_response(self, rel: "Relationship") -> float:
         """Score the reponse using the relative RMSE error."""
-        rel_error = np.linalg.norm(
-            self._response_mean - rel._response_mean
-        ) / np.linalg.norm(self._response_mean)
+        # as with np.linalg.norm of the masked difference, bins masked in either
+        # response contribute this response's value rather than being skipped
+        mean = np.ma.getdata(self._response_mean)
+        masked = np.ma.getmaskarray(self._response_mean) | np.ma.getmaskarray(
+            rel._response_mean
+        )
+        diff = np.where(masked, mean, mean - np.ma.getdata(rel._response_mean))
+        rel_error = np.sqrt(np.dot(diff, diff) / np.dot(mean, mean))
         score = np.exp(-rel_error)
         return score
 
 
+def _region_relationships(
+    ref: xr.Dataset,
+    com: xr.Dataset,
+    var_dep: str,
+    var_ind: str,
+    region: Union[str, None],
+) -> tuple[Relationship, Relationship]:
+    """Return the reference and comparison relationships in the given region."""
+    ilamb_regions = Regions()
+    refr = ilamb_regions.restrict_to_region(ref, region)
+    comr = ilamb_regions.restrict_to_region(com, region)
+    rel_ref = Relationship(refr[var_dep], refr[var_ind])
+    rel_com = Relationship(comr[var_dep], comr[var_ind])
+    return rel_ref, rel_com
+
+
 class relationship_analysis(ILAMBAnalysis):
     def __init__(self, dep_variable: str, ind_variable: str):
         self.dep_variable = dep_variable
@@ -191,17 +398,22 @@ class relationship_analysis(ILAMBAnalysis):
         analysis_name = "Relationship"
         var_ind = self.ind_variable
         var_dep = self.dep_variable
+        ref, com = cmp.align_coords(ref, com, quantify=False)
         for var in self.required_variables():
-            ref, com = cmp.make_comparable(ref, com, var)
-        ref = ref.pint.dequantify()
-        com = com.pint.dequantify()
-        ilamb_regions = Regions()
+            ref, com = cmp.convert_var(ref, com, var)
+        # the regions are independent, so restricting the data and building the
+        # relationships is done concurrently. The responses are built here as the
+        # binning is already parallel when numba is available.
+        region_relationships = partial(
+            _region_relationships, ref, com, var_dep, var_ind
+        )
+        if len(regions) > 1:
+            with ThreadPoolExecutor() as pool:
+                relationships = list(pool.map(region_relationships, regions))
+        else:
+            relationships = [region_relationships(region) for region in regions]
         dfs = []
-        for region in regions:
-            refr = ilamb_regions.restrict_to_region(ref, region)
-            comr = ilamb_regions.restrict_to_region(com, region)
-            rel_ref = Relationship(refr[var_dep], refr[var_ind])
-            rel_com = Relationship(comr[var_dep], comr[var_ind])
+        for region, (rel_ref, rel_com) in zip(regions, relationships):
             rel_com = rel_ref.compute_limits(rel_com)
             rel_ref.build_response()
             rel_com.build_response()
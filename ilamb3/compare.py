@@ -38,26 +38,73 @@ def nest_spatial_grids(*args):
             dim = ds.cf.add_bounds(dim_name)[f"{dim_name}_bounds"]
         return dim.to_numpy().flatten()
 
+    # resolve the spatial dimension names of each argument once
+    dim_names = [
+        (dset.get_dim_name(arg, "lat"), dset.get_dim_name(arg, "lon")) for arg in args
+    ]
+
     # find the union of all the breaks, and then the centroids of this irregular grid
-    lat = np.empty(0)
-    lon = np.empty(0)
-    for arg in args:
+    lat = []
+    lon = []
+    for arg, (lat_name, lon_name) in zip(args, dim_names):
         arg = arg.to_dataset() if isinstance(arg, xr.DataArray) else arg
-        lat = np.union1d(lat, _return_breaks(arg, dset.get_dim_name(arg, "lat")))
-        lon = np.union1d(lon, _return_breaks(arg, dset.get_dim_name(arg, "lon")))
+        lat.append(_return_breaks(arg, lat_name))
+        lon.append(_return_breaks(arg, lon_name))
+    lat = np.unique(np.concatenate(lat))
+    lon = np.unique(np.concatenate(lon))
     lat = 0.5 * (lat[:-1] + lat[1:])
     lon = 0.5 * (lon[:-1] + lon[1:])
+
+    def _mask(var: xr.DataArray, inside: list[xr.DataArray]):
+        if var.dtype.kind not in "biufc":
+            return var
+        if var.dtype.kind in "biu":
+            var = var.astype(float)
+        inside = [m for m in inside if m.dims[0] in var.dims]
+        if not inside:
+            return var
+        return var.where(inside[0] & inside[1] if len(inside) > 1 else inside[0])
+
+    # the nearest neighbor lookup only depends on the source grid, so we compute it
+    # once per unique grid and apply it to each argument by indexing
+    lookup = {}
     out = []
-    for arg in args:
-        lat_name = dset.get_dim_name(arg, "lat")
-        lon_name = dset.get_dim_name(arg, "lon")
-        # the interp function will strip the units off the args, so we do some pint
-        # gymnastics to avoid warnings
-        iarg = (
-            arg.pint.dequantify()
-            .interp({lat_name: lat, lon_name: lon}, method="nearest")
-            .pint.quantify()
+    for arg, (lat_name, lon_name) in zip(args, dim_names):
+        src_lat = arg[lat_name].to_numpy()
+        src_lon = arg[lon_name].to_numpy()
+        key = (src_lat.tobytes(), src_lon.tobytes())
+        if key not in lookup:
+            lookup[key] = (
+                dset.nearest_index(src_lat, lat),
+                dset.nearest_index(src_lon, lon),
+            )
+        (ilat, mlat), (ilon, mlon) = lookup[key]
+        # indexing strips the units off the args, so we do some pint gymnastics to
+        # avoid warnings
+        iarg = arg.pint.dequantify().isel({lat_name: ilat, lon_name: ilon})
+        iarg = iarg.assign_coords(
+            {
+                lat_name: (lat_name, lat, arg[lat_name].attrs),
+                lon_name: (lon_name, lon, arg[lon_name].attrs),
+            }
         )
+        # as in interpolation, cells outside the source extent are undefined
+        inside = [
+            xr.DataArray(m, dims=d)
+            for m, d in [(mlat, lat_name), (mlon, lon_name)]
+            if not m.all()
+        ]
+        if isinstance(iarg, xr.DataArray):
+            iarg = _mask(iarg, inside)
+        else:
+            iarg = iarg.assign(
+                {
+                    name: _mask(var, inside)
+                    for name, var in iarg.data_vars.items()
+                    if lat_name in var.dims or lon_name in var.dims
+                }
+            )
+        iarg = iarg.pint.quantify()
         # if 'bounds' existed, they will now be interpolated and incorrect
         for dim_name in [lat_name, lon_name]:
             dim = iarg[dim_name]
@@ -75,6 +122,12 @@ def is_spatially_aligned(dsa: xr.Dataset, dsb: xr.Dataset) -> bool:
     blat_name = dset.get_dim_name(dsb, "lat")
     alon_name = dset.get_dim_name(dsa, "lon")
     blon_name = dset.get_dim_name(dsb, "lon")
+    # datasets derived from one another share their coordinate arrays
+    if (
+        dsa[alat_name].data is dsb[blat_name].data
+        and dsa[alon_name].data is dsb[blon_name].data
+    ):
+        return True
     if dsa[alat_name].size != dsb[blat_name].size:
         return False
     if dsa[alon_name].size != dsb[blon_name].size:
@@ -152,36 +205,73 @@ def adjust_lon(dsa: xr.Dataset, dsb: xr.Dataset) -> tuple[xr.Dataset, xr.Dataset
     blon_name = dset.get_dim_name(dsb, "lon")
     if alon_name is None or blon_name is None:
         return dsa, dsb
-    a360 = (dsa[alon_name].min() >= 0) * (dsa[alon_name].max() <= 360)
-    b360 = (dsb[blon_name].min() >= 0) * (dsb[blon_name].max() <= 360)
-    if a360 and not b360:
-        dsb[blon_name] = dsb[blon_name] % 360
-        if "bounds" in dsb[blon_name].attrs and dsb[blon_name].attrs["bounds"] in dsb:
-            dsb[dsb[blon_name].attrs["bounds"]] = (
-                dsb[dsb[blon_name].attrs["bounds"]] % 360
-            )
-        dsb = dsb.sortby(blon_name)
-    elif not a360 and b360:
-        dsb[blon_name] = (dsb[blon_name] + 180) % 360 - 180
-        if "bounds" in dsb[blon_name].attrs and dsb[blon_name].attrs["bounds"] in dsb:
-            dsb[dsb[blon_name].attrs["bounds"]] = (
-                dsb[dsb[blon_name].attrs["bounds"]] + 180
-            ) % 360 - 180
-        dsb = dsb.sortby(blon_name)
+    a360 = bool(dsa[alon_name].min() >= 0) and bool(dsa[alon_name].max() <= 360)
+    b360 = bool(dsb[blon_name].min() >= 0) and bool(dsb[blon_name].max() <= 360)
+    if a360 == b360:
+        return dsa, dsb
+    # wrap into [0,360) or [-180,180) to match dsa
+    shift = 0 if a360 else 180
+    dsb[blon_name] = (dsb[blon_name] + shift) % 360 - shift
+    bounds = dsb[blon_name].attrs.get("bounds")
+    if bounds in dsb:
+        dsb[bounds] = (dsb[bounds] + shift) % 360 - shift
+    # longitudes of regional data are often still in order once wrapped, in which case
+    # the data need not be reordered
+    lon = dsb[blon_name].values
+    if (lon[:-1] > lon[1:]).any():
+        dsb = dsb.isel({blon_name: np.argsort(lon, kind="stable")})
     return dsa, dsb
 
 
-def make_comparable(
-    ref: xr.Dataset, com: xr.Dataset, varname: str
+def align_coords(
+    ref: xr.Dataset, com: xr.Dataset, quantify: bool = True
 ) -> tuple[xr.Dataset, xr.Dataset]:
-    """."""
+    """Return the reference and comparison trimmed to their temporal overlap, with
+    uniform longitudes, and with units quantified unless `quantify` is False.
+
+    These operations depend only on the coordinates and so may be done once no matter
+    how many variables are then made comparable with `convert_var`.
+
+    """
     # trim away time
     ref, com = trim_time(ref, com)
 
-    # convert units
-    ref = ref.pint.quantify()
-    com = dset.convert(com, ref[varname].pint.units, varname=varname)
-
     # ensure longitudes are uniform
     ref, com = adjust_lon(ref, com)
+
+    if quantify:
+        ref = ref.pint.quantify()
+        com = com.pint.quantify()
     return ref, com
+
+
+def convert_var(
+    ref: xr.Dataset, com: xr.Dataset, varname: str
+) -> tuple[xr.Dataset, xr.Dataset]:
+    """Return the comparison with `varname` converted to the units of the reference.
+
+    If the datasets are not quantified, the conversion is done using the units
+    attributes and the datasets are returned unquantified.
+
+    """
+    if ref[varname].pint.units is not None:
+        com = dset.convert(com, ref[varname].pint.units, varname=varname)
+        return ref, com
+    ref_units = ref[varname].attrs.get("units")
+    com_units = com[varname].attrs.get("units")
+    if ref_units == com_units:
+        return ref, com
+    var = dset._scale_units(com[varname], ref_units)
+    if var is None:
+        var = dset.convert(com[varname], ref_units).pint.dequantify()
+        var.attrs["units"] = ref_units
+    return ref, com.assign({varname: var})
+
+
+def make_comparable(
+    ref: xr.Dataset, com: xr.Dataset, varname: str
+) -> tuple[xr.Dataset, xr.Dataset]:
+    """Return the reference and comparison aligned and with `varname` in the same
+    units."""
+    ref, com = align_coords(ref, com)
+    return convert_var(ref, com, varname)
@@ -1,11 +1,12 @@
 """Dataset functions for ILAMB"""
 
+import threading
+from functools import lru_cache
 from typing import Any, Literal, Union
 
 import numpy as np
 import xarray as xr
-
-from ilamb3.regions import Regions
+from cf_xarray.units import units
 
 
 def get_dim_name(
@@ -28,19 +29,64 @@ def get_dim_name(
     datasets are not CF-compliant (e.g. raw CESM model output).
 
     """
-    dim_names = {
-        "time": ["time"],
-        "lat": ["lat", "latitude", "Latitude", "y"],
-        "lon": ["lon", "longitude", "Longitude", "x"],
-        "depth": ["depth"],
-    }
-    possible_names = dim_names[dim]
-    dim_name = set(dset.dims).intersection(possible_names)
+    return _find_dim_name(tuple(dset.dims), dim)
+
+
+def nearest_index(
+    src: np.ndarray, tgt: np.ndarray
+) -> tuple[Union[np.ndarray, slice], np.ndarray]:
+    """Return the index of the nearest `src` entry to each `tgt` entry.
+
+    Parameters
+    ----------
+    src
+        The source coordinate values, which need not be sorted.
+    tgt
+        The target coordinate values.
+
+    Returns
+    -------
+    ind
+        The index into `src` of the nearest value to each target, or a full slice if
+        this is every entry of `src` in order. Ties are broken toward the lower value,
+        as in nearest neighbor interpolation.
+    inside
+        Whether each target lies within the extent of `src`.
+
+    """
+    order = np.argsort(src, kind="stable")
+    src = src[order]
+    ind = order[np.searchsorted(0.5 * (src[:-1] + src[1:]), tgt, side="left")]
+    if ind.size == src.size and (ind == np.arange(src.size)).all():
+        ind = slice(None)
+    return ind, (tgt >= src[0]) & (tgt <= src[-1])
+
+
+_DIM_NAMES = {
+    "time": ("time",),
+    "lat": ("lat", "latitude", "Latitude", "y"),
+    "lon": ("lon", "longitude", "Longitude", "x"),
+    "depth": ("depth",),
+}
+
+
+@lru_cache(maxsize=256)
+def _find_dim_name(dims: tuple[str, ...], dim: str) -> str:
+    """Return the name of the `dim` dimension among `dims`, cached as the same few
+    combinations of dimensions are seen repeatedly in an analysis."""
+    possible_names = _DIM_NAMES[dim]
+    dim_name = [name for name in possible_names if name in dims]
     if len(dim_name) != 1:
-        msg = f"{dim} dimension not found: {dset.dims}] "
+        msg = f"{dim} dimension not found: {dims}] "
         msg += f"not in [{','.join(possible_names)}]"
         raise KeyError(msg)
-    return str(dim_name.pop())
+    return str(dim_name[0])
+
+
+def _get_space_dims(dset: Union[xr.Dataset, xr.DataArray]) -> tuple[str, str]:
+    """Return the names of the latitude and longitude dimensions of the dataset."""
+    dims = tuple(dset.dims)
+    return _find_dim_name(dims, "lat"), _find_dim_name(dims, "lon")
 
 
 def get_time_extent(
@@ -82,8 +128,12 @@ def compute_time_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray
         if time.size == 1:
             msg = "Cannot estimate time measures from single value without bounds"
             raise ValueError(msg)
-        delt = time.diff(dim="time").to_numpy().astype(float) * 1e-9 / 3600 / 24
-        delt = np.hstack([delt[0], delt, delt[-1]])
+        # differences of cftime objects are datetime.timedelta, so we cast to match
+        dt = np.diff(time.values).astype("timedelta64[ns]")
+        delt = np.empty(time.size + 1)
+        np.divide(dt, np.timedelta64(1, "D"), out=delt[1:-1])
+        delt[0] = delt[1]
+        delt[-1] = delt[-2]
         msr = xr.DataArray(0.5 * (delt[:-1] + delt[1:]), coords=[time], dims=["time"])
         msr = msr.pint.quantify("d")
         return msr
@@ -103,6 +153,15 @@ def compute_time_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray
     return measure
 
 
+def _edges(centroids: np.ndarray) -> np.ndarray:
+    """Return the cell edges of 1D centroids, extrapolating the end cells."""
+    edges = np.empty(centroids.size + 1)
+    edges[1:-1] = 0.5 * (centroids[:-1] + centroids[1:])
+    edges[0] = centroids[0] - 0.5 * (centroids[1] - centroids[0])
+    edges[-1] = centroids[-1] + 0.5 * (centroids[-1] - centroids[-2])
+    return edges
+
+
 def compute_cell_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray:
     """Return the area of each cell.
 
@@ -113,8 +172,7 @@ def compute_cell_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray
 
     """
     earth_radius = 6.371e6  # [m]
-    lat_name = get_dim_name(dset, "lat")
-    lon_name = get_dim_name(dset, "lon")
+    lat_name, lon_name = _get_space_dims(dset)
     lat = dset[lat_name]
     lon = dset[lon_name]
     latb_name = lat.attrs["bounds"] if "bounds" in lat.attrs else None
@@ -127,49 +185,126 @@ def compute_cell_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray
         and lonb_name is not None
         and lonb_name in dset
     ):
-        delx = dset[lonb_name] * np.pi / 180
-        dely = np.sin(dset[latb_name] * np.pi / 180)
+        delx = np.deg2rad(dset[lonb_name])
         other_dims = delx.dims[-1]
         delx = earth_radius * delx.diff(other_dims).squeeze()
-        dely = earth_radius * dely.diff(other_dims).squeeze()  # type: ignore
+        dely = dset[latb_name]
+        bnds = dely.values
+        if bnds.ndim == 2 and (bnds[1:, 0] == bnds[:-1, 1]).all():
+            # contiguous cells share their edges, so we only need one sine per edge
+            edges = np.sin(np.deg2rad(np.append(bnds[:, 0], bnds[-1, 1])))
+            dely = dely.isel({other_dims: 0}, drop=True).copy(
+                data=earth_radius * np.diff(edges)
+            )
+            dely = dely.squeeze()
+        else:
+            dely = np.sin(np.deg2rad(dely))
+            dely = earth_radius * dely.diff(other_dims).squeeze()  # type: ignore
         msr = dely * delx
         msr.attrs["units"] = "m2"
         msr = msr.pint.quantify()
         return msr
     # ...and if they aren't, we assume the lat/lon we have is a cell centroid
     # and compute the area.
-    lon = lon.values
-    lat = lat.values
-    delx = 0.5 * (lon[:-1] + lon[1:])
-    dely = 0.5 * (lat[:-1] + lat[1:])
-    delx = np.vstack(
-        [
-            np.hstack([lon[0] - 0.5 * (lon[1] - lon[0]), delx]),
-            np.hstack([delx, lon[-1] + 0.5 * (lon[-1] - lon[-2])]),
-        ]
-    ).T
-    dely = np.vstack(
-        [
-            np.hstack([lat[0] - 0.5 * (lat[1] - lat[0]), dely]),
-            np.hstack([dely, lat[-1] + 0.5 * (lat[-1] - lat[-2])]),
-        ]
-    ).T
-    delx = delx * np.pi / 180
-    dely = np.sin(dely * np.pi / 180)
-    delx = earth_radius * np.diff(delx, axis=1).squeeze()
-    dely = earth_radius * np.diff(dely, axis=1).squeeze()
-    delx = xr.DataArray(
-        data=np.abs(delx), dims=[lon_name], coords={lon_name: dset[lon_name]}
+    # the edges are transformed in their own buffers, and then the widths in theirs
+    lon_edges = _edges(lon.values)
+    lat_edges = _edges(lat.values)
+    np.deg2rad(lon_edges, out=lon_edges)
+    np.sin(np.deg2rad(lat_edges, out=lat_edges), out=lat_edges)
+    delx = np.subtract(lon_edges[1:], lon_edges[:-1])
+    dely = np.subtract(lat_edges[1:], lat_edges[:-1])
+    for width in [delx, dely]:
+        np.multiply(width, earth_radius, out=width)
+        np.abs(width, out=width)
+    # the areas are the outer product of the widths, which we build directly as a
+    # quantity rather than broadcasting dataarrays and then quantifying
+    msr = xr.DataArray(
+        units.Quantity(np.outer(dely, delx), "m2"),
+        dims=[lat_name, lon_name],
+        coords={lat_name: dset[lat_name], lon_name: dset[lon_name]},
     )
-    dely = xr.DataArray(
-        data=np.abs(dely), dims=[lat_name], coords={lat_name: dset[lat_name]}
-    )
-    msr = dely * delx
-    msr.attrs["units"] = "m2"
-    msr = msr.pint.quantify()
     return msr
 
 
+# measures by their coordinates, least recently used first, bounded by their total size
+_MEASURES_CACHE: dict[tuple, tuple[list, xr.DataArray]] = {}
+_MEASURES_CACHE_NBYTES = 2**27
+_MEASURES_CACHE_LOCK = threading.Lock()
+
+
+def _cached_measures(
+    dset: Union[xr.Dataset, xr.DataArray], dims: list[str], compute
+) -> xr.DataArray:
+    """Return `compute(dset)`, reusing a previous result for the same coordinates.
+
+    Measures only depend on the `dims` coordinates (and their bounds), so we key the
+    cache on their names and values. This lets datasets read separately but on the same
+    grid share measures. Object arrays (cftime) cannot be keyed by their bytes, so for
+    these we keep a reference along with the result and match by identity.
+
+    The cached data is shared by all callers and so is made read-only, modifying it in
+    place raises an error. Callers which need to modify the measures must copy them.
+
+    """
+    names = list(dims)
+    for dim in dims:
+        bounds = dset[dim].attrs.get("bounds")
+        if isinstance(dset, xr.Dataset) and bounds in dset:
+            names.append(bounds)
+    deps = [dset.indexes[n] if n in dset.indexes else dset[n].data for n in names]
+    key = [compute, *names]
+    for dep in deps:
+        values = np.asarray(dep)
+        if values.dtype.hasobject:
+            key.append(id(dep))
+        else:
+            key.append((values.dtype.str, values.shape, values.tobytes()))
+    key = tuple(key)
+    with _MEASURES_CACHE_LOCK:
+        # move to the end so the least recently used entry is evicted first
+        entry = _MEASURES_CACHE.pop(key, None)
+        if entry is not None:
+            _MEASURES_CACHE[key] = entry
+    if entry is None:
+        msr = compute(dset)
+        data = getattr(msr.data, "magnitude", msr.data)
+        if isinstance(data, np.ndarray):
+            data.flags.writeable = False
+        entry = (deps, msr)
+        with _MEASURES_CACHE_LOCK:
+            while _MEASURES_CACHE and (
+                sum(cached.nbytes for _, cached in _MEASURES_CACHE.values())
+                + msr.nbytes
+                > _MEASURES_CACHE_NBYTES
+            ):
+                _MEASURES_CACHE.pop(next(iter(_MEASURES_CACHE)))
+            if msr.nbytes <= _MEASURES_CACHE_NBYTES:
+                _MEASURES_CACHE[key] = entry
+    # a shallow copy, so that callers may rename or set attributes without changing
+    # the cached measures
+    return entry[1].copy(deep=False)
+
+
+def _get_time_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray:
+    """Return the time measures of the dataset, computing them only if needed."""
+    if isinstance(dset, xr.Dataset) and "time_measures" in dset:
+        return dset["time_measures"]
+    return _cached_measures(dset, [get_dim_name(dset, "time")], compute_time_measures)
+
+
+def _get_cell_measures(dset: Union[xr.Dataset, xr.DataArray]) -> xr.DataArray:
+    """Return the cell measures of the dataset, computing them only if needed."""
+    if isinstance(dset, xr.Dataset) and "cell_measures" in dset:
+        return dset["cell_measures"]
+    return _cached_measures(dset, list(_get_space_dims(dset)), compute_cell_measures)
+
+
+def _window_sum(var: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Return the weighted sum of `var` over its last two axes, skipping nans."""
+    var = np.where(np.isnan(var), 0, var)
+    return np.einsum("...ij,...ij->...", var, weights)
+
+
 def coarsen_dataset(dset: xr.Dataset, res: float = 0.5) -> xr.Dataset:
     """Return the mass-conversing spatially coarsened dataset.
 
@@ -184,8 +319,7 @@ def coarsen_dataset(dset: xr.Dataset, res: float = 0.5) -> xr.Dataset:
         The target resolution in degrees.
 
     """
-    lat_name = get_dim_name(dset, "lat")
-    lon_name = get_dim_name(dset, "lon")
+    lat_name, lon_name = _get_space_dims(dset)
     fine_per_coarse = int(
         round(res / np.abs(dset[lat_name].diff(lat_name).mean().values))  # type: ignore
     )
@@ -195,26 +329,103 @@ def coarsen_dataset(dset: xr.Dataset, res: float = 0.5) -> xr.Dataset:
     # new areas. We also need to keep track of nan's to apply a mask to the
     # coarsened dataset.
     if "cell_measures" not in dset:
-        dset["cell_measures"] = compute_cell_measures(dset)
-    nll = (
-        dset.notnull()
-        .any(dim=[d for d in dset.dims if d not in [lat_name, lon_name]])
-        .coarsen({"lat": fine_per_coarse, "lon": fine_per_coarse}, boundary="pad")
-        .sum()  # type: ignore
-        .astype(int)
+        # the measures are left in the input dataset as a copy which may be modified
+        dset["cell_measures"] = _get_cell_measures(dset).copy()
+    #
+    # The variables and measures are windowed so that the fine cells of each coarse
+    # cell lie along window dimensions (a reshaped view when the grid divides evenly).
+    # The integral is then a single fused weighted sum over the windows, and the count
+    # of valid fine cells reduces the same view. The units are carried in the
+    # attributes as pint greatly slows these operations.
+    dset = dset.pint.dequantify()
+    msr = dset["cell_measures"]
+    coarsen = {lat_name: fine_per_coarse, lon_name: fine_per_coarse}
+    window = {lat_name: (lat_name, "lat_window"), lon_name: (lon_name, "lon_window")}
+    window_dims = ["lat_window", "lon_window"]
+
+    def _prepare(var: xr.DataArray) -> xr.DataArray:
+        var = var.broadcast_like(msr).transpose(*var.dims, ...)
+        # If dask backed, align the spatial chunks with the coarse cells so that each
+        # task coarsens locally, leaving the other chunks alone. Variables may be
+        # chunked differently, so each is aligned from its own chunks.
+        if var.chunks is not None:
+            var = var.chunk(
+                {
+                    dim: max(1, var.chunksizes[dim][0] // fine_per_coarse)
+                    * fine_per_coarse
+                    for dim in coarsen
+                }
+            )
+        return var
+
+    windowed = (
+        dset.drop("cell_measures")
+        .map(_prepare)
+        .coarsen(coarsen, boundary="pad")
+        .construct(window)
     )
-    dset_coarse = (
-        (dset.drop("cell_measures") * dset["cell_measures"])
-        .coarsen({"lat": fine_per_coarse, "lon": fine_per_coarse}, boundary="pad")
-        .sum()  # type: ignore
+    weights = msr.coarsen(coarsen, boundary="pad").construct(window).fillna(0)
+    other_dims = [d for d in windowed.dims if d not in [*window, *window_dims]]
+    nll = windowed.notnull().any(dim=other_dims).sum(dim=window_dims)
+    dset_coarse = xr.apply_ufunc(
+        _window_sum,
+        windowed,
+        weights,
+        input_core_dims=[window_dims, window_dims],
+        dask="allowed",
+        keep_attrs=True,
+    ).assign_coords(
+        {
+            lat_name: windowed[lat_name].mean(dim="lat_window"),
+            lon_name: windowed[lon_name].mean(dim="lon_window"),
+        }
     )
     cell_measures = compute_cell_measures(dset_coarse)
-    dset_coarse = dset_coarse / cell_measures
+    # Masking the coarse areas, which are small, and then dividing applies the mask
+    # in the same pass over the variables.
+    area = xr.where(nll > 0, cell_measures.pint.dequantify(), np.nan)
+    dset_coarse = dset_coarse / area
     dset_coarse["cell_measures"] = cell_measures
-    dset_coarse = xr.where(nll == 0, np.nan, dset_coarse)
     return dset_coarse
 
 
+def _magnitude(var: xr.DataArray) -> tuple[xr.DataArray, str]:
+    """Return `var` with the pint quantity, if any, replaced by its magnitude, along
+    with its units.
+
+    This avoids `pint.dequantify`, whose checks on the wrapped data stringify the whole
+    array and so cost far more than the reductions on small grids.
+
+    """
+    var_units = var.pint.units
+    if var_units is None:
+        return var, var.attrs.get("units", "1")
+    return var.copy(data=var.data.magnitude), str(var_units)
+
+
+def _integrate(
+    var: xr.DataArray, msr: xr.DataArray, dim: Union[str, list[str]], mean: bool
+) -> xr.DataArray:
+    """Return the `msr` weighted integral, or mean, of `var` over `dim`.
+
+    As of v2023.6.0, weighted sums drop units from pint if the weights are over *all*
+    the dimensions of the dataarray, and pint slows the reductions in any case. So we
+    reduce the magnitudes, work out the units of the result ourselves, and quantify
+    once at the end.
+
+    """
+    var, var_units = _magnitude(var)
+    msr, msr_units = _magnitude(msr)
+    out = var.weighted(msr)
+    if mean:
+        out = out.mean(dim=dim)
+        out.attrs["units"] = var_units
+    else:
+        out = out.sum(dim=dim)
+        out.attrs["units"] = f"({var_units})*({msr_units})"
+    return out.pint.quantify()
+
+
 def integrate_time(
     dset: Union[xr.Dataset, xr.DataArray],
     varname: Union[str, None] = None,
@@ -255,18 +466,10 @@ def integrate_time(
     if isinstance(dset, xr.Dataset):
         assert varname is not None
         var = dset[varname]
-        msr = (
-            dset["time_measures"]
-            if "time_measures" in dset
-            else compute_time_measures(dset)
-        )
     else:
         var = dset
-        msr = compute_time_measures(dset)
-    var = var.pint.quantify()
-    if mean:
-        return var.weighted(msr).mean(dim=time_name)
-    return var.weighted(msr).sum(dim=time_name)
+    msr = _get_time_measures(dset)
+    return _integrate(var, msr, time_name, mean)
 
 
 def std_time(dset: Union[xr.Dataset, xr.DataArray], varname: Union[str, None] = None):
@@ -286,16 +489,8 @@ def std_time(dset: Union[xr.Dataset, xr.DataArray], varname: Union[str, None] =
 
     """
     time_name = get_dim_name(dset, "time")
-    if isinstance(dset, xr.Dataset):
-        var = dset[varname]
-        msr = (
-            dset["time_measures"]
-            if "time_measures" in dset
-            else compute_time_measures(dset)
-        )
-    else:
-        var = dset
-        msr = compute_time_measures(dset)
+    var = dset[varname] if isinstance(dset, xr.Dataset) else dset
+    msr = _get_time_measures(dset)
     var = var.pint.quantify()
     return var.weighted(msr).std(dim=time_name)
 
@@ -339,30 +534,17 @@ def integrate_space(
 
     """
     if region is not None:
+        # imported here as ilamb3.regions uses this module
+        from ilamb3.regions import Regions
+
         regions = Regions()
         dset = regions.restrict_to_region(dset, region)
-    space = [get_dim_name(dset, "lat"), get_dim_name(dset, "lon")]
+    space = list(_get_space_dims(dset))
     if not isinstance(dset, xr.Dataset):
         dset = dset.to_dataset()
     var = dset[varname]
-    msr = (
-        dset["cell_measures"]
-        if "cell_measures" in dset
-        else compute_cell_measures(dset)
-    )
-    # As of v2023.6.0, weighted sums drop units from pint if the weights are
-    # over *all* the dimensions of the dataarray. Will do some pint gymnastics
-    # to avoid the issue.
-    var = var.pint.dequantify()
-    msr = msr.pint.dequantify()
-    out = var.weighted(msr)
-    if mean:
-        out = out.mean(dim=space)
-        out.attrs["units"] = var.attrs["units"]
-    else:
-        out = out.sum(dim=space)
-        out.attrs["units"] = f"({var.attrs['units']})*({msr.attrs['units']})"
-    return out.pint.quantify()
+    msr = _get_cell_measures(dset)
+    return _integrate(var, msr, space, mean)
 
 
 def sel(dset: xr.Dataset, coord: str, cmin: Any, cmax: Any):
@@ -375,41 +557,34 @@ def sel(dset: xr.Dataset, coord: str, cmin: Any, cmax: Any):
     and max to be the limits of the slice.
     """
 
-    def _get_interval(dset, dim, value, side):
-        coord = dset[dim]
-        if "bounds" in coord.attrs:
-            if coord.attrs["bounds"] in dset:
-                coord = dset[coord.attrs["bounds"]]
-                ind = ((coord[:, 0] <= value) & (coord[:, 1] >= value)).to_numpy()
-                ind = np.where(ind)[0]
-                assert len(ind) <= 2
-                assert len(ind) > 0
-                if len(ind) == 2:
-                    if side == "low":
-                        return ind[1]
-                return ind[0]
-        raise NotImplementedError(f"Must have a bounds {coord}")
-
-    dset = dset.isel(
-        {
-            coord: slice(
-                _get_interval(dset, coord, cmin, "low"),
-                _get_interval(dset, coord, cmax, "high") + 1,
-            )
-        }
-    )
-    # adjust the bounds and coord values
-    bnds = dset[coord].attrs["bounds"]
-    dset[bnds][0, 0] = cmin
-    dset[bnds][-1, 1] = cmax
-    dim = dset[coord].to_numpy()
-    dim[0] = dset[bnds][0, 0].values + 0.5 * (
-        dset[bnds][0, 1].values - dset[bnds][0, 0].values
-    )
-    dim[-1] = dset[bnds][-1, 0].values + 0.5 * (
-        dset[bnds][-1, 1].values - dset[bnds][-1, 0].values
-    )
+    bnds_name = dset[coord].attrs.get("bounds")
+    if bnds_name is None or bnds_name not in dset:
+        raise NotImplementedError(f"Must have a bounds {dset[coord]}")
+    bnds = dset[bnds_name].values
+
+    # The bounds are sorted, so the cells containing each value span from the first
+    # whose upper bound is not less than it to the last whose lower bound is not more.
+    values = np.asarray([cmin, cmax], dtype=bnds.dtype)
+    first = np.searchsorted(bnds[:, 1], values, side="left")
+    count = np.searchsorted(bnds[:, 0], values, side="right") - first
+    assert (count <= 2).all()
+    assert (count > 0).all()
+    # a value on an edge shared by two cells starts the slice in the second cell and
+    # ends it in the first
+    low = first[0] + (count[0] == 2)
+    high = first[1]
+    dset = dset.isel({coord: slice(low, high + 1)})
+
+    # adjust the bounds and coord values, on copies as the selection is a view into
+    # the original dataset
+    bnds = dset[bnds_name].values.copy()
+    bnds[0, 0] = cmin
+    bnds[-1, 1] = cmax
+    dim = dset[coord].values.copy()
+    dim[0] = bnds[0, 0] + 0.5 * (bnds[0, 1] - bnds[0, 0])
+    dim[-1] = bnds[-1, 0] + 0.5 * (bnds[-1, 1] - bnds[-1, 0])
     attrs = dset[coord].attrs
+    dset[bnds_name] = dset[bnds_name].copy(data=bnds)
     dset[coord] = dim
     dset[coord].attrs = attrs
     return dset
@@ -444,15 +619,67 @@ def integrate_depth(
     return var.weighted(msr).sum(dim="depth")
 
 
+@lru_cache
+def _conversion_factor(src: str, dst: str) -> Union[float, None]:
+    """Return the factor converting `src` to `dst` units, or None if the conversion
+    is not a simple scaling (temperature offsets for example)."""
+    if units.Quantity(0.0, src).to(dst).magnitude != 0:
+        return None
+    return units.Quantity(1.0, src).to(dst).magnitude
+
+
+def _scale_units(var: xr.DataArray, unit: str) -> Union[xr.DataArray, None]:
+    """Return the unquantified `var` in `unit` by scaling, or None if not possible.
+
+    The conversion factors are cached by the units strings, which avoids pint parsing
+    the units and finding the conversion path with every call.
+
+    """
+    if var.pint.units is not None or "units" not in var.attrs:
+        return None
+    factor = _conversion_factor(var.attrs["units"], str(unit))
+    if factor is None:
+        return None
+    var = var * factor
+    var.attrs["units"] = str(unit)
+    return var
+
+
 def convert(
     dset: Union[xr.Dataset, xr.DataArray],
     unit: str,
     varname: Union[str, None] = None,
 ) -> Union[xr.Dataset, xr.DataArray]:
     """Convert the units of the dataarray."""
-    dset = dset.pint.quantify()
     if isinstance(dset, xr.DataArray):
-        return dset.pint.to(unit)
+        var = _scale_units(dset, unit)
+        if var is not None:
+            return var.pint.quantify()
+        return dset.pint.quantify().pint.to(unit)
     assert varname is not None
-    dset[varname] = dset[varname].pint.to(unit)
-    return dset
+    return convert_many(dset, {varname: unit})
+
+
+def convert_many(dset: xr.Dataset, mapping: dict[str, str]) -> xr.Dataset:
+    """Convert the units of several variables of the dataset at once.
+
+    Parameters
+    ----------
+    dset
+        The input dataset.
+    mapping
+        The units to convert to, keyed by variable name.
+
+    Returns
+    -------
+    dset
+        The quantified dataset with the variables converted.
+
+    """
+    scaled = {}
+    for varname, unit in mapping.items():
+        var = _scale_units(dset[varname], unit)
+        if var is not None:
+            scaled[varname] = var
+    mapping = {key: val for key, val in mapping.items() if key not in scaled}
+    return dset.assign(scaled).pint.quantify().pint.to(mapping)
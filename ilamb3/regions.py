@@ -3,43 +3,35 @@ system via a static property of the class. It also comes with methods for defini
 additional regions by lat/lon bounds or by a mask specified by a netCDF4 file. A set of
 regions used in the Global Fire Emissions Database (GFED) is included by default."""
 
+import hashlib
 import os
-from typing import Literal, Union
+import threading
+from typing import Union
 
 import numpy as np
 import xarray as xr
 
+from ilamb3.dataset import get_dim_name, nearest_index
 
-def get_dim_name(
-    dset: Union[xr.Dataset, xr.DataArray], dim: Literal["time", "lat", "lon"]
-) -> str:
-    """Return the name of the `dim` dimension from the dataset.
 
-    Parameters
-    ----------
-    dset
-        The input dataset/dataarray.
-    dim
-        The dimension to find in the dataset/dataarray
+def _nearest_slice(coord: np.ndarray, start: float, stop: float) -> slice:
+    """Return the slice of the increasing `coord` from the entry nearest `start` to the
+    entry nearest `stop`, breaking ties toward the larger entry as `sel` does."""
+    if coord.size == 1:
+        return slice(0, 1)
+    values = np.array([start, stop], dtype=float)
+    ind = np.searchsorted(coord, values).clip(1, coord.size - 1)
+    ind -= (values - coord[ind - 1]) < (coord[ind] - values)
+    return slice(ind[0], ind[1] + 1)
 
-    Note
-    ----
-    Duplicate of function in ilamb3.database to avoid circular import.
 
-    """
-    dim_names = {
-        "time": ["time"],
-        "lat": ["lat", "latitude", "Latitude", "y"],
-        "lon": ["lon", "longitude", "Longitude", "x"],
-        "depth": ["depth"],
-    }
-    possible_names = dim_names[dim]
-    dim_name = set(dset.dims).intersection(possible_names)
-    if len(dim_name) != 1:
-        msg = f"{dim} dimension not found: {dset.dims}] "
-        msg += f"not in [{','.join(possible_names)}]"
-        raise KeyError(msg)
-    return str(dim_name.pop())
+def _nearest_mask(coord: np.ndarray, start: float, stop: float) -> np.ndarray:
+    """Return where `coord` lies in the entries `restrict_to_bbox` selects between
+    `start` and `stop`, for a `coord` which need not be sorted."""
+    order = np.argsort(coord, kind="stable")
+    mask = np.zeros(coord.size, dtype=bool)
+    mask[order[_nearest_slice(coord[order], start, stop)]] = True
+    return mask
 
 
 def restrict_to_bbox(
@@ -54,31 +46,42 @@ def restrict_to_bbox(
     """Return the dataset selected to the nearest bounding box.
 
     This is awkward because as of `v2023.6.0`, the `method` keyword cannot be used in
-    slices. Note that this routine will sort the dimensions because slicing does not
-    work well on unsorted indices.
+    slices, so we find the nearest indices ourselves. Note that this routine will sort
+    the dimensions because slicing does not work well on unsorted indices.
 
     """
-    var = var.sortby(list(var.dims))
-    var = var.sel(
+    # sorting copies the whole variable, so only do so if needed. Dimensions without an
+    # index, such as those of cell bounds, have no order to check.
+    if not all(
+        var.indexes[dim].is_monotonic_increasing
+        for dim in var.dims
+        if dim in var.indexes
+    ):
+        var = var.sortby(list(var.dims))
+    var = var.isel(
         {
-            lat_name: slice(
-                var[lat_name].sel({lat_name: lat0}, method="nearest"),
-                var[lat_name].sel({lat_name: latf}, method="nearest"),
-            ),
-            lon_name: slice(
-                var[lon_name].sel({lon_name: lon0}, method="nearest"),
-                var[lon_name].sel({lon_name: lonf}, method="nearest"),
-            ),
+            lat_name: _nearest_slice(var[lat_name].values, lat0, latf),
+            lon_name: _nearest_slice(var[lon_name].values, lon0, lonf),
         }
     )
     return var
 
 
+def _grid_hash(coord: xr.DataArray) -> bytes:
+    """Return a digest of the coordinate values."""
+    return hashlib.md5(np.ascontiguousarray(coord.values).tobytes()).digest()
+
+
 class Regions:
     """A class for unifying the treatment of regions in ILAMB."""
 
     _regions = {}
     _sources = {}
+    # the masks of netCDF regions on target grids, least recently used first
+    _mask_cache = {}
+    _mask_cache_size = 16
+    _mask_cache_lock = threading.Lock()
+    _bootstrapped = False
 
     @property
     def regions(self):
@@ -113,6 +116,7 @@ class Regions:
         assert len(lats) == 2
         assert len(lons) == 2
         rtype = 0
+        Regions._clear_label(label)
         Regions._regions[label] = [rtype, name, lats, lons]
         Regions._sources[label] = source
 
@@ -145,7 +149,7 @@ class Regions:
             ids = [
                 v
                 for v in dsr.data_vars
-                if dsr[v].ndim == 2 and dsr[v].dtype == np.integer
+                if dsr[v].ndim == 2 and np.issubdtype(dsr[v].dtype, np.integer)
             ]
             if len(ids) == 0:
                 raise ValueError(
@@ -158,14 +162,65 @@ class Regions:
             ids = ids[0]
         labels = list(dsr[dsr[ids].attrs["labels"]].to_numpy())
         names = list(dsr[dsr[ids].attrs["names"]].to_numpy())
-        for label, name in zip(labels, names):
-            dar = xr.where(dsr[ids] == labels.index(label), 1, 0)
-            Regions._regions[label] = [rtype, name, dar]
+        # The regions of a file share a single read of its ids, from which the masks
+        # are built when needed. The file itself is then no longer needed.
+        ids = dsr[ids].load()
+        if isinstance(netcdf, str):
+            dsr.close()
+        for idx, (label, name) in enumerate(zip(labels, names)):
+            Regions._clear_label(label)
+            Regions._regions[label] = [rtype, name, ids, idx]
             Regions._sources[label] = (
                 os.path.basename(netcdf) if isinstance(netcdf, str) else "dataset"
             )
         return labels
 
+    @classmethod
+    def clear_mask_cache(cls) -> None:
+        """Remove the region masks cached for each target grid."""
+        with cls._mask_cache_lock:
+            cls._mask_cache.clear()
+
+    @classmethod
+    def _clear_label(cls, label: str) -> None:
+        """Remove the cached masks of a region which is being redefined."""
+        with cls._mask_cache_lock:
+            for key in [key for key in cls._mask_cache if key[0] == label]:
+                cls._mask_cache.pop(key)
+
+    @classmethod
+    def _bootstrap(cls) -> None:
+        """Register the default regions, those used in GFED."""
+        regions = """
+        bona, Boreal North America             , 50, 80,-170, -60
+        tena, Temperate North America          , 30, 50,-125, -66
+        ceam, Central America                  , 10, 30,-115, -80
+        nhsa, Northern Hemisphere South America,  0, 13, -80, -50
+        shsa, Southern Hemisphere South America,-60,  0, -80, -33
+        euro, Europe                           , 35, 70, -10,  30
+        mide, Middle East                      , 20, 40, -10,  60
+        nhaf, Northern Hemisphere Africa       ,  0, 20, -20,  45
+        shaf, Southern Hemisphere Africa       ,-35,  0,  10,  45
+        boas, Boreal Asia                      , 55, 70,  30, 180
+        ceas, Central Asia                     , 30, 55,  30, 143
+        seas, Southeast Asia                   ,  5, 30,  65, 120
+        eqas, Equatorial Asia                  ,-10, 10, 100, 150
+        aust, Australia                        ,-41,-11, 112, 154
+        """.strip().split(
+            "\n"
+        )
+        r = cls()
+        for line in regions:
+            lbl, name, lat0, latf, lon0, lonf = line.split(",")
+            r.add_latlon_bounds(
+                lbl.strip(),
+                name.strip(),
+                [float(lat0), float(latf)],
+                [float(lon0), float(lonf)],
+                "Global Fire Emissions Database (GFED)",
+            )
+        cls._bootstrapped = True
+
     def get_name(self, label: str) -> str:
         """Return the region name given its label."""
         return Regions._regions[label][1]
@@ -193,20 +248,46 @@ class Regions:
             )
             return out
         if rtype == 1:
-            _, _, dar = rdata
+            _, _, dar, idx = rdata
             rlat_name = get_dim_name(dar, "lat")
             rlon_name = get_dim_name(dar, "lon")
             dar = dar.rename({rlat_name: lat_name, rlon_name: lon_name})
-            out = xr.where(
-                dar.interp(
-                    {lat_name: var[lat_name], lon_name: var[lon_name]},
-                    method="nearest",
-                ),
-                var,
-                np.nan,
+            # the mask on the target grid is reused by all variables on that grid
+            key = (
+                label,
+                lat_name,
+                lon_name,
+                _grid_hash(var[lat_name]),
+                _grid_hash(var[lon_name]),
             )
+            with Regions._mask_cache_lock:
+                # move to the end so the least recently used entry is evicted first
+                mask = Regions._mask_cache.pop(key, None)
+                if mask is not None:
+                    Regions._mask_cache[key] = mask
+            if mask is None:
+                # The nearest neighbor interpolation of the mask is done by indexing
+                # the nearest source cells, which are found in each dimension
+                # independently. Outside the region file grid, the mask is undefined
+                # and so passes the variable through.
+                ilat, inlat = nearest_index(dar[lat_name].values, var[lat_name].values)
+                ilon, inlon = nearest_index(dar[lon_name].values, var[lon_name].values)
+                mask = dar.isel({lat_name: ilat, lon_name: ilon}) == idx
+                mask = mask.assign_coords(
+                    {lat_name: var[lat_name], lon_name: var[lon_name]}
+                )
+                inside = xr.DataArray(inlat, dims=lat_name) & xr.DataArray(
+                    inlon, dims=lon_name
+                )
+                mask = (mask | ~inside).rename(dar.name)
+                with Regions._mask_cache_lock:
+                    while len(Regions._mask_cache) >= Regions._mask_cache_size:
+                        Regions._mask_cache.pop(next(iter(Regions._mask_cache)))
+                    Regions._mask_cache[key] = mask
+            # restrict first so that only the selection is masked, the mask aligning
+            # to it by coordinates
             out = restrict_to_bbox(
-                out,
+                var,
                 lat_name,
                 lon_name,
                 dar[lat_name].min(),
@@ -214,51 +295,135 @@ class Regions:
                 dar[lon_name].min(),
                 dar[lon_name].max(),
             )
+            out = out.where(mask)
             return out
         raise ValueError(f"Region type #{rtype} not recognized")
 
+    def apply_region(
+        self,
+        var: Union[xr.Dataset, xr.DataArray],
+        label: Union[str, None],
+    ) -> tuple[Union[xr.Dataset, xr.DataArray, None], bool]:
+        """Return the variable restricted to the region and whether it has data there.
+
+        This restricts the variable just once for the common pattern of only using a
+        region which has data. The check is made on the restricted variable, which is
+        usually much smaller than the original. For a dataset, only the variables with
+        both spatial dimensions are checked.
+
+        Parameters
+        ----------
+        var
+            The dataset/dataarray to restrict.
+        label
+            The region label, or None for no restriction.
+
+        Returns
+        -------
+        out, has_data
+            The restricted variable, or None if it has no data in the region, and
+            whether it has data.
+
+        """
+        out = self.restrict_to_region(var, label)
+        valid = out.notnull()
+        if isinstance(valid, xr.Dataset):
+            # only variables on the grid are masked by a region, others such as the
+            # time bounds would always count as data
+            space = {get_dim_name(var, "lat"), get_dim_name(var, "lon")}
+            has_data = any(
+                bool(valid[v].any())
+                for v in valid.data_vars
+                if space.issubset(valid[v].dims)
+            )
+        else:
+            has_data = bool(valid.any())
+        return (out if has_data else None), has_data
+
+    def get_masks(
+        self, labels: list[str], var: Union[xr.Dataset, xr.DataArray]
+    ) -> xr.DataArray:
+        """Return the masks of several lat/lon bounds regions on the grid of a variable.
+
+        The cells in each region are those which `restrict_to_region` selects, from the
+        cell nearest the lower bounds to the cell nearest the upper bounds.
+
+        Parameters
+        ----------
+        labels
+            The labels of the regions, which must be defined by lat/lon bounds.
+        var
+            The dataset/dataarray whose grid the masks are built on.
+
+        Returns
+        -------
+        masks
+            A boolean array along a new `region` dimension, true inside each region.
+
+        """
+        rdata = [Regions._regions[label] for label in labels]
+        rtypes = {r[0] for r in rdata if r[0] != 0}
+        if rtypes:
+            raise ValueError(f"Region type #{rtypes.pop()} not supported for masks")
+        lat_name = get_dim_name(var, "lat")
+        lon_name = get_dim_name(var, "lon")
+        lat = var[lat_name].values
+        lon = var[lon_name].values
+        mlat = np.array([_nearest_mask(lat, *r[2]) for r in rdata]).reshape(
+            -1, lat.size
+        )
+        mlon = np.array([_nearest_mask(lon, *r[3]) for r in rdata]).reshape(
+            -1, lon.size
+        )
+        return xr.DataArray(
+            mlat[:, :, None] & mlon[:, None, :],
+            dims=["region", lat_name, lon_name],
+            coords={
+                "region": list(labels),
+                lat_name: var[lat_name],
+                lon_name: var[lon_name],
+            },
+        )
+
+    def has_data(self, labels: list[str], var: xr.DataArray) -> xr.DataArray:
+        """Return whether the variable has data in each of the lat/lon bounds regions.
+
+        Parameters
+        ----------
+        labels
+            The labels of the regions, which must be defined by lat/lon bounds.
+        var
+            The dataarray to check.
+
+        Returns
+        -------
+        has_data
+            A boolean array along the `region` dimension.
+
+        """
+        masks = self.get_masks(labels, var)
+        space = list(masks.dims[1:])
+        # reduce away the other dimensions first, so the regions see one 2D field
+        valid = var.notnull()
+        other_dims = [d for d in valid.dims if d not in space]
+        if other_dims:
+            valid = valid.any(dim=other_dims)
+        return (masks & valid).any(dim=space)
+
     def region_scalars_to_map(self, scalars: dict[str, float]) -> xr.DataArray:
         da = xr.concat(
             [
-                xr.where(Regions._regions[r][2] == 0, np.nan, 1) * val
+                xr.where(Regions._regions[r][2] == Regions._regions[r][3], val, np.nan)
                 for r, val in scalars.items()
                 if Regions._regions[r][0] == 1
             ],
             dim="region",
         )
-        mask = da.isnull().all(dim="region")
-        da = da.sum(dim="region")
-        da = xr.where(mask, np.nan, da)
+        # cells outside of all the regions remain nan
+        da = da.sum(dim="region", min_count=1)
         return da
 
 
-# If no regions have been registered, then add these
-if len(Regions().regions) == 0:
-    r = Regions()
-    regions = """
-    bona, Boreal North America             , 50, 80,-170, -60
-    tena, Temperate North America          , 30, 50,-125, -66
-    ceam, Central America                  , 10, 30,-115, -80
-    nhsa, Northern Hemisphere South America,  0, 13, -80, -50
-    shsa, Southern Hemisphere South America,-60,  0, -80, -33
-    euro, Europe                           , 35, 70, -10,  30
-    mide, Middle East                      , 20, 40, -10,  60
-    nhaf, Northern Hemisphere Africa       ,  0, 20, -20,  45
-    shaf, Southern Hemisphere Africa       ,-35,  0,  10,  45
-    boas, Boreal Asia                      , 55, 70,  30, 180
-    ceas, Central Asia                     , 30, 55,  30, 143
-    seas, Southeast Asia                   ,  5, 30,  65, 120
-    eqas, Equatorial Asia                  ,-10, 10, 100, 150
-    aust, Australia                        ,-41,-11, 112, 154
-    """.strip().split(
-        "\n"
-    )
-    for line in regions:
-        lbl, name, lat0, latf, lon0, lonf = line.split(",")
-        r.add_latlon_bounds(
-            lbl.strip(),
-            name.strip(),
-            [float(lat0), float(latf)],
-            [float(lon0), float(lonf)],
-            "Global Fire Emissions Database (GFED)",
-        )
+# If the default regions have not been registered, then add them
+if not Regions._bootstrapped:
+    Regions._bootstrap()
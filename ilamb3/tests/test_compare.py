@@ -0,0 +1,24 @@
+import numpy as np
+import xarray as xr
+
+from ilamb3 import compare as cmp
+from ilamb3.tests.test_dataset import generate_test_dset
+
+
+def test_nest_spatial_grids():
+    ds1 = generate_test_dset(1)
+    # a finer grid which only covers part of the coarse grid
+    rs = np.random.RandomState(2)
+    lat = np.linspace(-80, 40, 9)
+    lon = np.linspace(-170, 100, 13)
+    ds2 = xr.Dataset(
+        {"da": xr.DataArray(rs.rand(9, 13), coords=[lat, lon], dims=["lat", "lon"])}
+    )
+    ds2["da"].attrs["units"] = "kg m-2 s-1"
+    out1, out2 = cmp.nest_spatial_grids(ds1, ds2)
+    # nesting keeps the values of the nearest source cells, as interpolating does
+    for ds, out in [(ds1, out1), (ds2, out2)]:
+        expected = ds["da"].interp(lat=out["lat"], lon=out["lon"], method="nearest")
+        assert out["da"].dims == ds["da"].dims
+        assert np.allclose(out["da"].pint.dequantify(), expected, equal_nan=True)
+    assert out2["da"].isnull().any()
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+import pytest
 import xarray as xr
 
 from ilamb3 import dataset as dset
@@ -55,3 +56,111 @@ def test_basic():
         assert isinstance(exc, KeyError)
     t0, _ = dset.get_time_extent(ds)
     assert t0 == ds["time"].isel(time=0)
+
+
+def test_coarsen():
+    ds = generate_test_dset()
+    ds["da"] = ds["da"].where(ds["lat"] > 0)
+    msr = dset.compute_cell_measures(ds).pint.dequantify()
+    coarse = dset.coarsen_dataset(ds.copy(), res=90)
+    assert coarse["da"].dims == ds["da"].dims
+    # the coarse values are the area weighted means of the valid fine cells
+    area = coarse["cell_measures"].pint.dequantify()
+    valid = ds["da"].notnull().any(dim="time").coarsen(lat=2, lon=2).sum()
+    expected = (ds["da"] * msr).coarsen(lat=2, lon=2).sum() / area
+    expected = expected.where(valid > 0).transpose(*coarse["da"].dims)
+    assert np.allclose(coarse["da"], expected, equal_nan=True)
+    # which conserves the integral
+    fine = dset.integrate_space(ds, "da").pint.dequantify()
+    assert np.allclose(dset.integrate_space(coarse, "da").pint.dequantify(), fine)
+
+
+def test_cached_measures(monkeypatch):
+    ds = generate_test_dset()
+    total = dset.integrate_space(ds, "da").pint.dequantify()
+    # modifying measures left in a dataset does not change those of later calls
+    coarse = dset.coarsen_dataset(ds, res=90)
+    ds["cell_measures"] *= 0.5
+    coarse["cell_measures"] *= 0.5
+    ds = generate_test_dset()
+    assert np.allclose(dset.integrate_space(ds, "da").pint.dequantify(), total)
+    # the cached measures are shared and cannot be modified in place
+    msr = dset._get_cell_measures(ds)
+    assert dset._get_cell_measures(ds).data.magnitude is msr.data.magnitude
+    with pytest.raises(ValueError):
+        msr *= 0.5
+    # the cache is bounded by the size of the measures it holds
+    monkeypatch.setattr(dset, "_MEASURES_CACHE", {})
+    monkeypatch.setattr(dset, "_MEASURES_CACHE_NBYTES", 2 * msr.nbytes)
+    for seed in range(3):
+        dset._get_cell_measures(ds.assign_coords(lat=ds["lat"] + seed))
+    assert len(dset._MEASURES_CACHE) == 2
+
+
+def test_cached_measures_dims():
+    ds = generate_test_dset()
+    msr = dset.compute_cell_measures(ds)
+    # grids with the same values but other dim names do not share measures
+    assert dset._get_cell_measures(ds).dims == ("lat", "lon")
+    ds = ds.rename({"lat": "latitude", "lon": "longitude"})
+    cached = dset._get_cell_measures(ds)
+    assert cached.dims == ("latitude", "longitude")
+    assert np.allclose(cached.pint.dequantify(), msr.pint.dequantify())
+
+
+def test_sel():
+    bnds = np.array([[0.0, 10.0], [10.0, 20.0], [20.0, 50.0], [50.0, 100.0]])
+    ds = xr.Dataset(
+        data_vars={
+            "da": xr.DataArray(np.arange(4.0), dims=["depth"]),
+            "depth_bnds": xr.DataArray(bnds, dims=["depth", "nb"]),
+        },
+        coords={"depth": bnds.mean(axis=1)},
+    )
+    ds["depth"].attrs["bounds"] = "depth_bnds"
+    out = dset.sel(ds, "depth", 5.0, 60.0)
+    assert out["da"].values.tolist() == [0, 1, 2, 3]
+    assert out["depth_bnds"].values.tolist() == [[5, 10], [10, 20], [20, 50], [50, 60]]
+    assert out["depth"].values.tolist() == [7.5, 15, 35, 55]
+    assert out["depth"].attrs["bounds"] == "depth_bnds"
+    # values on shared edges start in the upper cell and end in the lower one
+    out = dset.sel(ds, "depth", 10.0, 50.0)
+    assert out["da"].values.tolist() == [1, 2]
+    assert out["depth_bnds"].values.tolist() == [[10, 20], [20, 50]]
+    # the input dataset is left alone
+    assert ds["depth_bnds"].values.tolist() == bnds.tolist()
+    assert ds["depth"].values.tolist() == [5, 15, 35, 75]
+    with pytest.raises(AssertionError):
+        dset.sel(ds, "depth", 5.0, 200.0)
+
+
+def test_convert():
+    ds = generate_test_dset()
+    ds["tas"] = xr.full_like(ds["da"], 300.0)
+    ds["tas"].attrs["units"] = "K"
+    # scaling by the cached factors matches a pint conversion, and offsets still work
+    for varname, unit in [("da", "g m-2 d-1"), ("da", "Pg m-2 yr-1"), ("tas", "degC")]:
+        expected = ds[varname].pint.quantify().pint.to(unit)
+        for da in [dset.convert(ds[varname], unit), dset.convert(ds, unit, varname)]:
+            da = da[varname] if isinstance(da, xr.Dataset) else da
+            assert da.pint.units == expected.pint.units
+            assert np.allclose(da.pint.dequantify(), expected.pint.dequantify())
+    out = dset.convert_many(ds, {"da": "g m-2 d-1", "tas": "degC"})
+    assert np.allclose(out["tas"].pint.dequantify(), 26.85)
+    assert (
+        out["da"].pint.units == ds["da"].pint.quantify().pint.to("g m-2 d-1").pint.units
+    )
+
+
+def test_coarsen_chunked():
+    ds = generate_test_dset()
+    ds["db"] = ds["da"] * 2
+    ds["db"].attrs["units"] = "kg m-2 s-1"
+    expected = dset.coarsen_dataset(ds.copy(), res=90)
+    # variables chunked differently along the spatial dims are coarsened alike
+    ds["da"] = ds["da"].chunk({"lat": 1})
+    ds["db"] = ds["db"].chunk({"lat": 3, "lon": 2})
+    coarse = dset.coarsen_dataset(ds, res=90)
+    for varname in ["da", "db"]:
+        assert coarse[varname].chunks is not None
+        assert np.allclose(coarse[varname], expected[varname])
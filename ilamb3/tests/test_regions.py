@@ -2,8 +2,9 @@ from pathlib import Path
 
 import intake
 import numpy as np
+import xarray as xr
 
-from ilamb3.regions import Regions
+from ilamb3.regions import Regions, _grid_hash
 from ilamb3.tests.test_dataset import generate_test_dset
 
 
@@ -13,6 +14,51 @@ def test_basic():
     assert reg.get_source("euro") == "Global Fire Emissions Database (GFED)"
 
 
+def test_masks():
+    reg = Regions()
+    da = xr.DataArray(
+        np.zeros((180, 360)),
+        coords={"lat": np.arange(-89.5, 90), "lon": np.arange(-179.5, 180)},
+        dims=("lat", "lon"),
+    )
+    masks = reg.get_masks(["euro", "aust"], da)
+    assert masks.dims == ("region", "lat", "lon")
+    # the masks select the cells nearest the bounds, as restricting does
+    assert masks.sel(region="euro").sum() == 36 * 41
+    assert masks.sel(region="aust").sum() == 31 * 43
+    for label in ["euro", "aust"]:
+        assert masks.sel(region=label).sum() == reg.restrict_to_region(da, label).size
+    # data only in the cells nearest the bounds is in the region for both
+    edge = da.where((da["lat"] == 70.5) & (da["lon"] == -9.5))
+    assert reg.has_data(["euro"], edge).values.tolist() == [True]
+    assert reg.apply_region(edge, "euro")[1]
+    da = da.where(~masks.sel(region="euro", drop=True))
+    assert reg.has_data(["euro", "aust"], da).values.tolist() == [False, True]
+    da = da.where(da["lat"] < 0)
+    out, has_data = reg.apply_region(da, "euro")
+    assert out is None and not has_data
+    out, has_data = reg.apply_region(da, "aust")
+    assert has_data and out.notnull().all()
+    # variables off the grid are not considered
+    ds = xr.Dataset({"v": da, "time_bnds": xr.DataArray(np.zeros((2, 2)))})
+    out, has_data = reg.apply_region(ds, "euro")
+    assert out is None and not has_data
+
+
+def test_restrict_bounds(monkeypatch):
+    ds = generate_test_dset().cf.add_bounds(["lat", "lon"])
+    expected = Regions().restrict_to_region(ds, "euro")
+
+    # sorted data with cell bounds is not sorted again
+    def sortby(*args, **kwargs):
+        raise AssertionError("sorted data was sorted again")
+
+    monkeypatch.setattr(xr.Dataset, "sortby", sortby)
+    out = Regions().restrict_to_region(ds, "euro")
+    xr.testing.assert_identical(out, expected)
+    assert out["lat_bounds"].dims == ("lat", "bounds")
+
+
 def test_netcdf():
     # can we add regions via a dataset?
     cat = intake.open_catalog(
@@ -34,3 +80,37 @@ def test_netcdf():
     assert np.isclose(ds["da"].mean(), 4.28285108e-09)
 
     Path("tmp.nc").unlink()
+
+
+def test_mask_cache(monkeypatch):
+    lat = np.arange(-89.5, 90)
+    lon = np.arange(-179.5, 180)
+    dsr = xr.Dataset(
+        {
+            "ids": xr.DataArray(
+                (lat[:, None] > 0) & (lon[None, :] > -500),
+                coords={"lat": lat, "lon": lon},
+                dims=["lat", "lon"],
+            ).astype(int),
+            "labels": xr.DataArray(["south", "north"], dims="n"),
+            "names": xr.DataArray(["South", "North"], dims="n"),
+        }
+    )
+    dsr["ids"].attrs = {"labels": "labels", "names": "names"}
+    reg = Regions()
+    reg.add_netcdf(dsr)
+    monkeypatch.setattr(Regions, "_mask_cache_size", 2)
+    reg.clear_mask_cache()
+    grids = [generate_test_dset(), generate_test_dset().isel(lat=[0, 1, 2])]
+    out = [reg.restrict_to_region(ds, "north") for ds in grids]
+    assert out[0]["da"].isel(time=0).notnull().sum() == 8
+    assert out[1]["da"].isel(time=0).notnull().sum() == 4
+    # the least recently used mask is evicted first
+    reg.restrict_to_region(grids[0], "north")
+    reg.restrict_to_region(grids[0], "south")
+    assert len(Regions._mask_cache) == 2
+    assert [key[:4] for key in Regions._mask_cache] == [
+        (label, "lat", "lon", _grid_hash(grids[0]["lat"]))
+        for label in ["north", "south"]
+    ]
+    reg.clear_mask_cache()